@@ -17,15 +17,122 @@ from modules.download_data import DownloadData
 from modules.alert_detector import AlertDetector
 from modules.preprocess import Preprocess
 from modules.email_generator import EmailGenerator
-from modules.secret_manager import get_secret
+from modules.secret_manager import get_secrets
 import json
 import yaml
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
 import argparse
 from datetime import datetime, timedelta
 import pandas as pd
 import logging
 import os
+import pickle
 from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
+
+def load_cached(path, loader, cache_folder = '.cache'):
+    """
+    Function to read a config file. The parsed content is saved in a pickle in the cache folder
+    and it is reused while the config file is not modified.
+
+    :param path: The path of the config file.
+    :type path: string
+    :param loader: The function that parses the opened file (json.load, yaml.load...).
+    :type loader: function
+    :param cache_folder: The folder where the parsed config files are saved.
+    :type cache_folder: string
+    """
+
+    cache_path = os.path.join(cache_folder, os.path.basename(path) + '.pkl')
+    mtime = os.path.getmtime(path)
+
+    # Use the cached content if it was saved from the current version of the file
+    try:
+        with open(cache_path, 'rb') as f:
+            cached_mtime, content = pickle.load(f)
+        if cached_mtime == mtime:
+            return content
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+        pass
+
+    with open(path, 'r') as f:
+        content = loader(f)
+
+    # The cache is only an optimization, so the config is returned even if it cannot be saved
+    try:
+        os.makedirs(cache_folder, exist_ok = True)
+        with open(cache_path, 'wb') as f:
+            pickle.dump((mtime, content), f)
+    except OSError:
+        logging.warning('The config file ' + path + ' could not be saved in the cache folder ' + cache_folder)
+
+    return content
+
+def download_metric(downloader, metric_info, start_date, end_date):
+    """
+    Function to download a single metric configured by the user. It uses different functions depending
+    on the source of the metric.
+
+    :param downloader: The object to download data from *GA* and *BQ*.
+    :type downloader: DownloadData
+    :param metric_info: The config of the metric.
+    :type metric_info: dict
+    :param start_date: The first date to download.
+    :type start_date: timestamp
+    :param end_date: The last date to download.
+    :type end_date: timestamp
+    :return: The metric table indexed by date (None if it is discarded) and the model info of its kpis.
+    """
+
+    logging.info('Downloading metric: ' + str(metric_info))
+    kpi_names_method = metric_info['kpiNamesMethod']
+    metric_table = None
+    if metric_info['source'] == 'GA':
+        # Download the metric
+        raw_metric = downloader.get_data_GA(view_id = metric_info['viewID'],
+                            metrics_input = [metric_info['metric']],
+                            dimensions_input = ['date'],
+                            #segments_input = [metric_info['segment']],
+                            filters_input = [metric_info['filters']],
+                            start_date = start_date.strftime('%Y-%m-%d'),
+                            end_date = end_date.strftime('%Y-%m-%d'))
+        
+        # Rename the columns in order to have a more informative ones
+        metric_rename = (metric_info['viewName'] + '{0}').format(*list(kpi_names_method.keys()))
+        raw_metric = raw_metric.rename(columns = {'ga:date': 'date', 'ga:' + metric_info['metric']: metric_rename})
+
+        # The single metric table will be joined with the rest of metrics.
+        # The dates must be unique in order to do a one to one join
+        metric_table = raw_metric.set_index('date', verify_integrity = True)
+
+    if metric_info['source'] == 'BQ':
+        # Download the metric
+        sql_query_input = metric_info['sqlQuery'].format(*[f"{key}" for key in list(kpi_names_method.keys())], 
+                                                        dateName = metric_info['dateName'],
+                                                        start_date = start_date.strftime(metric_info['dateFormat']),
+                                                        end_date = end_date.strftime(metric_info['dateFormat']))
+        raw_metric = downloader.get_data_BQ(sql_query_input = sql_query_input, use_bqstorage_api = True)
+        #print(raw_metric)
+        raw_metric = raw_metric.rename(columns = {metric_info['dateName']: 'date'})
+
+        # Convert the date into str type
+        dates = raw_metric['date'].astype(str)
+
+        # The date is in format YYYYMMDD, it must be in format YYYY-MM-DD
+        raw_metric['date'] = dates.str[:4] + '-' + dates.str[4:6] + '-' + dates.str[6:]
+
+        # If the data has duplicated dates, the index cannot be set and the metric is discarded.
+        # You have to rewrite the query in order to obtain an only register per day
+        try:
+            metric_table = raw_metric.set_index('date', verify_integrity = True)
+        except ValueError:
+            logging.warning('Your query ' + metric_info['sqlQuery'] + ( ' returns duplicated dates. '
+                                                                       'The metric will not be include in the analysis.'))
+        
+    return metric_table, kpi_names_method
 
 ## Get the arguments from the terminal command line execution
 if __name__ == "__main__":
@@ -66,15 +173,13 @@ if __name__ == "__main__":
 
     ## Read the config files. This config contains the necessary parameters
     ## like the credentials to read data, how to build the model, etc.
-    config_file = open('./config/general_config_' + env + '.json')
-    config_file = json.load(config_file)
+    config_file = load_cached('./config/general_config_' + env + '.json', json.load)
 
     ## Read the corresponding parameters from config_file
     # metrics = open('./config/metrics_' + env + '.json')
     # metrics = json.load(metrics)
 
-    with open('./config/metrics_' + env + '.yml', 'r') as f:
-        metrics = yaml.safe_load(f)
+    metrics = load_cached('./config/metrics_' + env + '.yml', lambda f: yaml.load(f, Loader = SafeLoader))
 
     # Read google project name
     google_project = config_file['googleProject']['project']
@@ -91,80 +196,44 @@ if __name__ == "__main__":
 
     ## Download data to make the analysis
     # Create an dataframe with dates, we will do a join for every metric we download on the key "date"
-    data = pd.DataFrame({'date': [(yesterday - timedelta(days = x)).strftime('%Y-%m-%d') for x in range(n_hist_data)]})
+    data = pd.DataFrame({'date': pd.date_range(end = yesterday, periods = n_hist_data, freq = 'D').strftime('%Y-%m-%d')})
 
-    # Final dataframe with the customized modelling parameters for every metric
-    model_params = pd.DataFrame()
+    # Every downloaded metric is indexed by date and gathered here, they are joined in a single step at the end
+    frames = [data.set_index('date')]
 
-    # Download the metrics. It iterates over the metrics info the user has configured. It uses different functions depending
-    # on the source of the metric
+    # Customized modelling parameters for every kpi. The final dataframe is built once all the metrics are read
+    kpi_params = {}
+
+    # Download the metrics. It iterates over the metrics info the user has configured.
+    # Every metric is downloaded in its own thread because the requests to GA and BQ are independent
     downloader = DownloadData(token_path)
-    for _, metric_info in tqdm(metrics.items()):
-        logging.info('Downloading metric: ' + str(metric_info))
-        kpi_names_method = metric_info['kpiNamesMethod']
-        if metric_info['source'] == 'GA':
-            # Download the metric
-            raw_metric = downloader.get_data_GA(view_id = metric_info['viewID'],
-                                metrics_input = [metric_info['metric']],
-                                dimensions_input = ['date'],
-                                #segments_input = [metric_info['segment']],
-                                filters_input = [metric_info['filters']],
-                                start_date = year_ago.strftime('%Y-%m-%d'),
-                                end_date = yesterday.strftime('%Y-%m-%d'))
-            
-            # Rename the columns in order to have a more informative ones
-            metric_rename = (metric_info['viewName'] + '{0}').format(*list(kpi_names_method.keys()))
-            raw_metric = raw_metric.rename(columns = {'ga:date': 'date', 'ga:' + metric_info['metric']: metric_rename})
-
-            # Merge the single metric table with the data with all the previous metrics. It will be accumulating
-            data = data.merge(raw_metric, on = 'date', how = 'left')
-            #print(data)
-
-        if metric_info['source'] == 'BQ':
-            # Download the metric
-            sql_query_input = metric_info['sqlQuery'].format(*[f"{key}" for key in list(kpi_names_method.keys())], 
-                                                            dateName = metric_info['dateName'],
-                                                            start_date = year_ago.strftime(metric_info['dateFormat']),
-                                                            end_date = yesterday.strftime(metric_info['dateFormat']))
-            raw_metric = downloader.get_data_BQ(sql_query_input = sql_query_input)
-            #print(raw_metric)
-            raw_metric = raw_metric.rename(columns = {metric_info['dateName']: 'date'})
-
-            # Convert the date into str type
-            raw_metric['date'] = raw_metric['date'].astype(str)
-
-            # The date is in format YYYYMMDD, it must be in format YYYY-MM-DD
-            raw_metric['date'] = raw_metric['date'].apply(lambda x: x[:4] + '-' + x[4:6] + '-' + x[6:])
-
-            # If the data has duplicated dates, the program raise an error
-            are_duplicated = raw_metric['date'].duplicated().any()
-            try:
-                assert not are_duplicated, 'Your query ' + metric_info['sqlQuery'] + ( ' returns duplicated dates. You have to '
-                                                                                        'rewrite it in order to obtain an only register per day.')
-                data = data.merge(raw_metric, on = 'date', how = 'left')
-            except AssertionError:
-                logging.warning('Your query ' + metric_info['sqlQuery'] + ( ' returns duplicated dates. '
-                                                                           'The metric will not be include in the analysis.'))
-            
-        # Create a table with model info for every metric
-        model_params_aux = []
-        for key in kpi_names_method.keys():
-            row = {'kpi': key}
-            for k, v in kpi_names_method[key].items():
-                row[k] = v
-            model_params_aux.append(row)
-        
-        model_params_aux = pd.DataFrame.from_records(model_params_aux)
+    with ThreadPoolExecutor(max_workers = max(1, min(16, len(metrics)))) as executor:
+        results = list(tqdm(executor.map(lambda metric_info: download_metric(downloader, metric_info, year_ago, yesterday), metrics.values()),
+                            total = len(metrics)))
+
+    for raw_metric, kpi_names_method in results:
+        if raw_metric is not None:
+            frames.append(raw_metric)
+        kpi_params.update(kpi_names_method)
+
+    # Join all the metrics with the dates table. Only the dates of the dates table are kept (left join)
+    data = pd.concat(frames, axis = 1).reindex(frames[0].index).reset_index()
+
+    # Create a table with model info for every metric
+    model_params = pd.DataFrame.from_dict(kpi_params, orient = 'index').rename_axis('kpi').reset_index()
 
-        model_params = model_params.append(model_params_aux, ignore_index = True)
+    # The Prophet metrics can be modeled with the faster AutoARIMA model in order to compare both of them
+    # The configs without this option keep the Prophet models
+    if config_file['model'].get('prophetAsAutoarima', 'False') == 'True':
+        model_params.loc[model_params['method'] == 'prophet', 'method'] = 'autoarima'
 
     print(model_params)
     # Sort by date
-    data = data.sort_values(by = 'date', ascending = True)
+    data.sort_values(by = 'date', ascending = True, inplace = True, ignore_index = True, kind = 'stable')
     print(data)
 
     # Divide data into model data and yesterday's actual data
-    real_value_table = data.iloc[-1:]
+    real_value_table = data.iloc[[-1]]
     data = data.iloc[:-1]
 
     ## Imput missing data
@@ -186,11 +255,7 @@ if __name__ == "__main__":
     # Force an alert
     force_alert = config['force_alert'] == 'True'
     if force_alert:
-        alerts_table.iloc[0,1] = 1
-        alerts_table.iloc[1,1] = 1
-        alerts_table.iloc[2,1] = 1
-        alerts_table.iloc[3,1] = 1
-        alerts_table.iloc[4,1] = 1
+        alerts_table.iloc[:5, 1] = 1
     only_alerts_table = alerts_table.loc[alerts_table['Alert'] == 1,['Metric', 'Prediction', 'Real', 'Details']]
     pd.set_option('display.max_rows', None)
     pd.set_option('display.expand_frame_repr', False)
@@ -203,10 +268,13 @@ if __name__ == "__main__":
         # We want only the alerts
         new_hist = only_alerts_table.copy()
         new_hist['Date'] = yesterday.strftime('%Y-%m-%d')
+        # The metric names are repeated, so they are stored as categories
+        new_hist['Metric'] = new_hist['Metric'].astype('category')
         downloader.upload_historical_alerts(project_id = project_id, new_hist = new_hist, env = env)
     
     if future_pred:
         logging.info('You chose to calculate predictions. Uploading to BQ...')
+        future_table['Metric'] = future_table['Metric'].astype('category')
         downloader.upload_future_pred(project_id = project_id, future_table = future_table, env = env, date = yesterday)
     
     if ev_pred:
@@ -222,13 +290,11 @@ if __name__ == "__main__":
         # Config some email parameters
         env = env.lower()
         # Get the email info from the Secret Manager of Google Cloud
-        email_from = get_secret(google_project, 'email_user_' + env, token_path)
-        emails_to = get_secret(google_project, 'email_to_' + env, token_path)
-        password = get_secret(google_project, 'email_password_' + env, token_path)
-        smtp_server = get_secret(google_project, 'email_smtp_server_' + env, token_path)
-        port = get_secret(google_project, 'email_smtp_port_' + env, token_path)
+        email_secrets = ['email_user_' + env, 'email_to_' + env, 'email_password_' + env, 'email_smtp_server_' + env, 'email_smtp_port_' + env]
+        email_from, emails_to, password, smtp_server, port = get_secrets(google_project, email_secrets, token_path)
         alerts_table_title = config_file['mail']['alertsTableTitle']
         # Create the email corpus and send the email
         email_generator = EmailGenerator(email_from = email_from, emails_to = emails_to, password = password, smtp_server = smtp_server, port = port)
         msg = email_generator.create_corpus(only_alerts_table = only_alerts_table, date = yesterday, alerts_table_title = alerts_table_title, future_table = future_table)
         email_generator.send_email(msg = msg)
+        email_generator.close()
@@ -1,6 +1,6 @@
 """
-This library uses a time series model in order to predict the alerts. Specifically, it uses a Prophet model and
-it is prepared to model daily data. Principally, we can summarize the process as follows:
+This library uses a time series model in order to predict the alerts. Specifically, it uses a Prophet, ARIMA or
+AutoARIMA (statsforecast) model and it is prepared to model daily data. Principally, we can summarize the process as follows:
 
 - First, each metric that is introduced in the config is modeled (the stationarity and the seasonality) until the day before yesterday.
 - After that, yesterday's data is predicted along with its confidence interval.
@@ -9,14 +9,185 @@ it is prepared to model daily data. Principally, we can summarize the process as
 
 from prophet import Prophet
 from config.alerts_table_styles.extra_styles import ExtraStylesPreAlerts
+from modules.extra_styles import get_extra_styles_methods
 import pandas as pd
+import numpy as np
 import matplotlib.pyplot as plt
 import logging
 import datetime
+from functools import cached_property
 from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import os
+import pickle
 
 import statsmodels.api as sm
 from pmdarima.arima import auto_arima
+from joblib import Memory, hash as joblib_hash
+
+# The extra styles methods for the related metrics
+PRE_ALERTS_METHODS = get_extra_styles_methods(ExtraStylesPreAlerts)
+
+# The fitted models are saved in disk, so they are reused while the data and the params do not change
+# The data changes every day, so the oldest models are removed when the cache is bigger than the limit
+MODELS_CACHE_LIMIT = '500M'
+memory = Memory(location = './.cache_models', verbose = 0, bytes_limit = MODELS_CACHE_LIMIT)
+
+# The params of the last Prophet fit of every metric are saved in disk in order to warm-start the next fit
+WARM_START_FOLDER = './.prophet_warm'
+# It must be changed if the saved params are not compatible anymore with the Prophet models
+WARM_START_VERSION = 2
+
+# Number of simulated draws of Prophet to build the confidence interval, if it is not set in the metric config
+# Less draws are faster, but they cannot resolve the tails of high confidence levels (e.g. 99.9)
+PROPHET_UNCERTAINTY_SAMPLES = 1000
+
+def _load_warm_start(metric, data):
+    """
+    Function to read the params to warm-start the Prophet fit of a metric.
+    If the last fit was made with the same data, the params that started that fit are returned,
+    so that the cached model is reused. It returns None if there are no saved params or they belong to other version.
+
+    :param metric: The metric to read the params.
+    :type metric: string
+    :param data: The time series with the columns 'ds' and 'y'.
+    :type data: Pandas DataFrame
+    """
+    try:
+        with open(os.path.join(WARM_START_FOLDER, metric + '.pkl'), 'rb') as f:
+            warm_start = pickle.load(f)
+    except (FileNotFoundError, pickle.UnpicklingError, EOFError):
+        return None
+    if warm_start.get('version') != WARM_START_VERSION:
+        return None
+    if warm_start['data_hash'] == joblib_hash(data):
+        return warm_start['init']
+    return warm_start['params']
+
+def _save_warm_start(metric, data, init, model):
+    """
+    Function to save the params of a fitted Prophet model so that they can be used to warm-start the next fit.
+    The data and the params that started the fit are also saved.
+
+    :param metric: The metric of the model.
+    :type metric: string
+    :param data: The time series with the columns 'ds' and 'y'.
+    :type data: Pandas DataFrame
+    :param init: The params that started the fit. None if it was not warm-started.
+    :type init: dict
+    :param model: The fitted Prophet model.
+    :type model: Prophet
+    """
+    # The params are flattened because Prophet saves them as 1-D arrays when the time series is constant
+    params = {p: np.asarray(model.params[p]).ravel()[0] for p in ['k', 'm', 'sigma_obs']}
+    params.update({p: np.asarray(model.params[p]).ravel() for p in ['delta', 'beta']})
+    os.makedirs(WARM_START_FOLDER, exist_ok = True)
+    with open(os.path.join(WARM_START_FOLDER, metric + '.pkl'), 'wb') as f:
+        pickle.dump({'version': WARM_START_VERSION, 'data_hash': joblib_hash(data), 'init': init, 'params': params}, f)
+
+def _build_prophet(confidence_interval, seasonality_mode, change_prior, uncertainty_samples):
+    """
+    Function to build a Prophet model that has not been trained.
+
+    :param confidence_interval: The confidence level to build the confidence interval. An integer between 1-99.
+    :type confidence_interval: integer
+    :param seasonality_model: The type of seasonality. It can be 'additive' or 'multiplicative'.
+    :type seasonality_model: string
+    :param change_prior: The changepoint_prior_scale parameter. Higher values return more sensibility in the changes of the time series.
+    :type change_prior: float
+    :param uncertainty_samples: Number of simulated draws to build the confidence interval.
+    :type uncertainty_samples: integer
+    """
+
+    # Build model, this can be parametrized to fit better to the metrics
+    model = Prophet(interval_width = confidence_interval/100,
+                    seasonality_mode = seasonality_mode,
+                    seasonality_prior_scale = 10.0,
+                    # The weekly seasonality is modeled with a Fourier order of 3
+                    weekly_seasonality = 3,
+                    daily_seasonality = False,
+                    changepoint_prior_scale = change_prior,
+                    # Number of simulated draws to build the confidence interval
+                    uncertainty_samples = uncertainty_samples)
+    
+    # model.add_seasonality(name = 'yearly', period = 365.25, fourier_order = 3)
+    # model.add_seasonality(name = 'monthly', period = 30.5, fourier_order = 3)
+
+    return model
+
+@memory.cache
+def _fit_prophet(data, confidence_interval, seasonality_mode, change_prior, uncertainty_samples, init = None):
+    """
+    Function to build and train a Prophet model.
+
+    :param data: The time series with the columns 'ds' and 'y'.
+    :type data: Pandas DataFrame
+    :param confidence_interval: The confidence level to build the confidence interval. An integer between 1-99.
+    :type confidence_interval: integer
+    :param seasonality_model: The type of seasonality. It can be 'additive' or 'multiplicative'.
+    :type seasonality_model: string
+    :param change_prior: The changepoint_prior_scale parameter. Higher values return more sensibility in the changes of the time series.
+    :type change_prior: float
+    :param uncertainty_samples: Number of simulated draws to build the confidence interval.
+    :type uncertainty_samples: integer
+    :param init: The params to start the fit. Prophet uses its default values for the params with a different shape.
+    :type init: dict
+    """
+
+    model = _build_prophet(confidence_interval, seasonality_mode, change_prior, uncertainty_samples)
+
+    # Train the model starting from the given params if they exist
+    if init is None:
+        model.fit(data)
+    else:
+        model.fit(data, init = init)
+
+    return model
+
+@memory.cache
+def _fit_arima(data):
+    """
+    Function to build and fit a SARIMAX model.
+
+    :param data: The time series with the date in the index.
+    :type data: Pandas DataFrame
+    """
+
+    # Create and fit the model with the corresponding hyperparams. The orders are searched stepwise
+    # The metrics are already fitted in parallel processes, so the search runs in a single process
+    model = auto_arima(data,
+                       seasonal = True,
+                       m = 7,
+                       trend = 'ct',
+                       stepwise = True,
+                       suppress_warnings = True,
+                       error_action = 'ignore')
+
+    return model
+
+def _fit_one_metric(alert_detector, metric, params):
+    """
+    Function to get the predictions table of a single metric with the method set in its model params.
+    It is defined at module level so that it can be executed in a different process.
+
+    :param alert_detector: The object with the data of the metrics.
+    :type alert_detector: AlertDetector
+    :param metric: The metric to analyze.
+    :type metric: string
+    :param params: The model params of the metric.
+    :type params: dict
+    """
+
+    if params['method'] == 'prophet':
+        # The number of draws is optional in the metric config
+        uncertainty_samples = params.get('uncertaintySamples', np.nan)
+        uncertainty_samples = PROPHET_UNCERTAINTY_SAMPLES if pd.isna(uncertainty_samples) else int(uncertainty_samples)
+        return alert_detector.get_prediction_PROPHET(metric,
+                                                     confidence_interval = params['confInt'],
+                                                     seasonality_mode = params['seasonMode'],
+                                                     change_prior = params['changePrior'],
+                                                     uncertainty_samples = uncertainty_samples)
+    return alert_detector.get_prediction_ARIMA(metric)
 
 class AlertDetector():
     """
@@ -39,8 +210,11 @@ class AlertDetector():
         self.data = data
         self.plot = plot
         self.date = date
+        # The dates are shared by all the metrics, so they are extracted only once
+        self.dates = data['date'].to_numpy()
 
-    def get_prediction_PROPHET(self, metric, confidence_interval = 95, seasonality_mode = 'multiplicative', change_prior = 0.5):
+    def get_prediction_PROPHET(self, metric, confidence_interval = 95, seasonality_mode = 'multiplicative', change_prior = 0.5,
+                               uncertainty_samples = PROPHET_UNCERTAINTY_SAMPLES):
         """
         Function to get the predictions table given a single metric.
         It uses a time series model based on Prophet library.
@@ -53,27 +227,25 @@ class AlertDetector():
         :type seasonality_model: string
         :param change_prior: The changepoint_prior_scale parameter. Higher values return more sensibility in the changes of the time series.
         :type change_prior: float
+        :param uncertainty_samples: Number of simulated draws to build the confidence interval.
+        :type uncertainty_samples: integer
         """
         
-        # Data must have columns renamed as this for Prophet model
-        data = self.data.rename(columns = {'date': 'ds', metric: 'y'})[['ds', 'y']]
-
-        # Build model, this can be parametrized to fit better to the metrics
-        model = Prophet(interval_width = confidence_interval/100,
-                        seasonality_mode = seasonality_mode,
-                        seasonality_prior_scale = 10.0,
-                        #weekly_seasonality = True,
-                        changepoint_prior_scale = change_prior)
-        
-        # model.add_seasonality(name = 'yearly', period = 365.25, fourier_order = 3)
-        # model.add_seasonality(name = 'monthly', period = 30.5, fourier_order = 3)
-        model.add_seasonality(name = 'weekly', period = 7, fourier_order = 3)
-
-        # Train the model
-        model.fit(data)
+        # Data must have columns named as this for Prophet model
+        data = pd.DataFrame({'ds': self.dates, 'y': self.data[metric].to_numpy()})
+
+        # Build and train the model starting from the params of the last fit of the metric
+        # It is only trained again if the data, the params or the starting params change
+        init = _load_warm_start(metric, data)
+        model = _fit_prophet(data, confidence_interval, seasonality_mode, change_prior, uncertainty_samples, init = init)
+        # The warm start is only an optimization, so the prediction goes on even if the params cannot be saved
+        try:
+            _save_warm_start(metric, data, init, model)
+        except (OSError, IndexError, KeyError):
+            logging.warning('The params of the Prophet model for ' + metric + ' could not be saved to warm-start the next fit')
 
         # We want the prediction for the rest of the month
-        remaining_days, _ = self.calculate_days_remaining_month()
+        remaining_days, _ = self.days_remaining_month
 
         table_for_predictions = model.make_future_dataframe(periods = remaining_days)
 
@@ -98,8 +270,8 @@ class AlertDetector():
         :type metric: string
         """
         
-        # Rename columns
-        data = self.data.rename(columns = {'date': 'ds', metric: 'y'})[['ds', 'y']]
+        # Build the table with the metric
+        data = pd.DataFrame({'ds': self.dates, 'y': self.data[metric].to_numpy()})
 
         # Change ds to datetime datatype
         data['ds'] = pd.to_datetime(data['ds'])
@@ -107,17 +279,11 @@ class AlertDetector():
         # The date has to be in the index
         data.set_index('ds', inplace = True)
 
-        # Create the model with the corresponding hyperparams
-        model = auto_arima(data,
-                           seasonal = True,
-                           m = 7,
-                           trend = 'ct')
-
-        # Fit the model
-        model.fit(data)
+        # Create and fit the model with the corresponding hyperparams. It is only fitted again if the data change
+        model = _fit_arima(data)
 
         # We want the prediction for the rest of the month
-        remaining_days, _ = self.calculate_days_remaining_month()
+        remaining_days, _ = self.days_remaining_month
 
         # Get the prediction and confidence intervals
         forecast, conf_int = model.predict(n_periods = remaining_days, return_conf_int = True)
@@ -135,6 +301,97 @@ class AlertDetector():
 
         return pred_table
 
+    def get_predictions_AUTOARIMA(self, metrics, confidence_intervals):
+        """
+        Function to get the predictions tables of several metrics.
+        It uses the AutoARIMA model from statsforecast library, which models all the metrics in a single call.
+
+        :param metrics: The metrics to analyze.
+        :type metrics: list
+        :param confidence_intervals: The confidence level of every metric to build the confidence interval.
+        :type confidence_intervals: dict
+        """
+
+        # statsforecast is slow to import, so it is only imported when a metric uses this method
+        from statsforecast import StatsForecast
+        from statsforecast.models import AutoARIMA
+
+        # Every metric is a different time series in a long table
+        data = self.data.melt(id_vars = 'date', value_vars = metrics, var_name = 'unique_id', value_name = 'y')
+        data = data.rename(columns = {'date': 'ds'})
+        data['ds'] = pd.to_datetime(data['ds'])
+        data['y'] = data['y'].astype(float)
+
+        # We want the prediction for the rest of the month
+        remaining_days, _ = self.days_remaining_month
+
+        # Build the model with a weekly seasonality and get the predictions for every confidence level
+        levels = sorted(set(float(ci) for ci in confidence_intervals.values()))
+        model = StatsForecast(models = [AutoARIMA(season_length = 7)], freq = 'D', n_jobs = -1)
+        forecast = model.forecast(df = data, h = remaining_days, level = levels).reset_index()
+
+        # Create the pred table of every metric with the predictions and confidence intervals
+        pred_tables = {}
+        for m in metrics:
+            level = float(confidence_intervals[m])
+            metric_forecast = forecast[forecast['unique_id'] == m]
+            pred_tables[m] = pd.DataFrame({'ds': metric_forecast['ds'].values,
+                                           'yhat': metric_forecast['AutoARIMA'].values,
+                                           'yhat_lower': metric_forecast[f'AutoARIMA-lo-{level}'].values,
+                                           'yhat_upper': metric_forecast[f'AutoARIMA-hi-{level}'].values})
+
+            # Plot time series
+            if self.plot:
+                metric_data = data[data['unique_id'] == m]
+                plt.plot(metric_data['ds'], metric_data['y'], label = 'Real data')
+                plt.plot(pred_tables[m]['ds'], pred_tables[m]['yhat'], label = 'Prediction')
+                plt.fill_between(pred_tables[m]['ds'], pred_tables[m]['yhat_lower'], pred_tables[m]['yhat_upper'], alpha = 0.3)
+                plt.legend()
+                plt.show()
+
+        return pred_tables
+
+    def get_pred_tables(self, metrics, model_params):
+        """
+        Function to get the predictions table of every metric that is analyzed with a time series model.
+        The models are independent, so they are built in parallel processes.
+
+        :param metrics: The metrics to analyze.
+        :type metrics: list
+        :param model_params: Table with all model params for every metric.
+        :type model_params: Pandas DataFrame
+        """
+
+        pred_tables = {}
+        if len(metrics) == 0:
+            return pred_tables
+
+        # Save the model params of every metric
+        params_by_kpi = model_params.set_index('kpi').to_dict('index')
+        metrics_params = {m: params_by_kpi[m] for m in metrics}
+
+        # The metrics with the AutoARIMA method are modeled together in a single call
+        autoarima_metrics = [m for m, params in metrics_params.items() if params['method'] == 'autoarima']
+        if len(autoarima_metrics) > 0:
+            confidence_intervals = {m: metrics_params[m]['confInt'] for m in autoarima_metrics}
+            pred_tables.update(self.get_predictions_AUTOARIMA(autoarima_metrics, confidence_intervals))
+        metrics_params = {m: params for m, params in metrics_params.items() if m not in autoarima_metrics}
+        if len(metrics_params) == 0:
+            return pred_tables
+
+        # The plots can only be shown from the main process
+        if self.plot:
+            for m, params in tqdm(metrics_params.items()):
+                pred_tables[m] = _fit_one_metric(self, m, params)
+            return pred_tables
+
+        with ProcessPoolExecutor(max_workers = min(len(metrics_params), os.cpu_count() or 1)) as executor:
+            futures = {executor.submit(_fit_one_metric, self, m, params): m for m, params in metrics_params.items()}
+            for future in tqdm(as_completed(futures), total = len(futures)):
+                pred_tables[futures[future]] = future.result()
+
+        return pred_tables
+
     def get_alerts_table(self, real_value_table, model_params, future_pred = False, limsup_alert = False):
         """
         Function to extract the info from the predictions table and create a new
@@ -155,147 +412,109 @@ class AlertDetector():
         # Save the metrics in a list
         metrics = self.data.drop('date', axis = 1).columns
 
-        # Create an empty DataFrame to concatenate the alerts of every metric
-        alerts_table = pd.DataFrame()
-        # Create the table with the future preds
-        _, last_day_current_month = self.calculate_days_remaining_month()
-        # Create range of dates for the future preds
-        delta = datetime.timedelta(days = 1)
-        init_date = self.date.date()
-        dates_list = []
-        while init_date <= last_day_current_month:
-            dates_list.append(init_date)
-            init_date += delta
-
-        #future_table = pd.DataFrame({'date': [x.strftime('%Y-%m-%d') for x in dates_list]})
-        future_table = pd.DataFrame(columns = ['Date', 'Metric', 'Prediction'])
+        # The future preds go from yesterday to the end of the month
+        remaining_days, _ = self.days_remaining_month
+        # Save the table with the future preds of every metric
+        future_frames = []
+
+        # Save the params of every metric in a dict in order to not search them in the table for every metric
+        params_by_kpi = model_params.set_index('kpi').to_dict('index')
 
         # We build the model and make predictions until the day before yesterday
-        
-        for m in tqdm(metrics):
+        # The metrics with all values as null cannot be modeled, they are shown as missing data
+        null_metrics = self.data[metrics].isnull().all(axis = 0)
+        for m in metrics[null_metrics]:
+            logging.warning('Your metric ' + m + ' have all values as null.')
+        model_metrics = [m for m in metrics if params_by_kpi[m]['method'] in ['prophet', 'arima', 'autoarima'] and not null_metrics[m]]
+
+        pred_tables = self.get_pred_tables(model_metrics, model_params)
+        # Remove the oldest fitted models if the cache has exceeded its limit
+        memory.reduce_size()
+
+        # Save if every metric has integer values. The columns can be of object type after filling the missing data
+        integer_metrics = {m: pd.api.types.infer_dtype(self.data[m], skipna = True) == 'integer' for m in metrics}
+
+        # Save the info of every metric in order to build the alerts table with all of them at once
+        alerts_info = {'Metric': [], 'Method': [], 'Real': [], 'Prediction': [], 'LimInf': [], 'LimSup': [], 'SendAlert': [], 'IsInteger': []}
+
+        for m in metrics:
             logging.info('Detecting the alerts for ' + m)
-            # The column has to have at least two values without nulls
-            are_complete_null = self.data[m].isnull().all()
-            assert not are_complete_null, 'Error: Your metric ' + m + (' have all values as null.')
             # Save the real data for yesterday
             real = real_value_table[m].iloc[0]
-            method = model_params.loc[model_params['kpi'] == m, 'method'].values[0]
+            params = params_by_kpi[m]
+            method = params['method']
+            is_integer = integer_metrics[m]
+            send_alert = params['sendAlert'] != 'False'
+            is_related = params['isRelated'] == 'True'
+            # The constraints do not have predictions
+            pred, liminf, limsup = np.nan, np.nan, np.nan
+            # The metrics without model have no data to compare with
+            if method in ['prophet', 'arima', 'autoarima'] and null_metrics[m]:
+                real = np.nan
             # Evaluate the alerts detection method
-            if method == 'prophet' or method == 'arima':
+            has_model = m in pred_tables
+            if has_model:
                 # Get the predictions for the metric
-                if method == 'prophet':
-                    confidence_interval = model_params.loc[model_params['kpi'] == m, 'confInt'].values[0]
-                    seasonality_mode = model_params.loc[model_params['kpi'] == m, 'seasonMode'].values[0]
-                    change_prior = model_params.loc[model_params['kpi'] == m, 'changePrior'].values[0]
-
-                    pred_table = self.get_prediction_PROPHET(m,
-                                                             confidence_interval = confidence_interval,
-                                                             seasonality_mode = seasonality_mode,
-                                                             change_prior = change_prior)
-                elif method == 'arima':
-                    pred_table = self.get_prediction_ARIMA(m)
-                # The last prediction is the yesterday prediction. It is saved in order to compared with real data
-                pred = pred_table.loc[pred_table['ds'] == self.date.strftime('%Y-%m-%d'), 'yhat'].values[0]
+                pred_table = pred_tables[m]
+                # Every pred table ends with the predictions from yesterday to the end of the month,
+                # so the yesterday prediction is the first of them. It is saved in order to compared with real data
+                yesterday_pred = pred_table.iloc[-remaining_days]
+                pred = yesterday_pred['yhat']
 
                 # Save the lower and upper limits of confidence interval in order to make the decision (alert or not alert)
-                liminf = pred_table.loc[pred_table['ds'] == self.date.strftime('%Y-%m-%d'), 'yhat_lower'].values[0]
-                limsup = pred_table.loc[pred_table['ds'] == self.date.strftime('%Y-%m-%d'), 'yhat_upper'].values[0]
+                liminf = yesterday_pred['yhat_lower']
+                limsup = yesterday_pred['yhat_upper']
                 
                 # If the variable has __related__ in the method, then apply new treatment to the predictions
-                is_related = model_params.loc[model_params['kpi'] == m, 'isRelated'].values[0] == 'True'
                 if is_related:
-                    extra_styles_inst = ExtraStylesPreAlerts()
-                    extra_styles_methods = [name_method for name_method in dir(extra_styles_inst) if callable(getattr(extra_styles_inst, name_method)) and not '__' in name_method]
-                    if len(extra_styles_methods) > 1:
-                        extra_styles_methods.remove('do_nothing')
-                    for name_method in extra_styles_methods:
-                        method = getattr(extra_styles_inst, name_method)
-                        pred, liminf, limsup = method(alerts_table, m, pred, liminf, limsup)
-                
-                # We cannot have negative predictions
-                pred = 0.0 if pred < 0 else pred
-
-                # We cannot have negative lims and if pred is 0, then liminf also must be zero
-                liminf = 0.0 if liminf < 0 or pred == 0 else liminf
-                limsup = 0.0 if limsup < 0 else limsup
-                
-                # Save if it is an alert or not and save the details
-                if pd.isna(real):
-                    details = 'Missing data.**'
-                    is_alert = 1
-                    # Convert the real value to -1.0 so that the remove_decimals function can be applied without error
-                    real = -1.0
-                else:
-                    if real < liminf:
-                        is_alert = 1
-                        details = 'Decreasing tendency.*'
-                    elif real > limsup and limsup_alert:
-                        is_alert = 1
-                        details = 'Increasing tendency.*'
-                    else:
-                        is_alert = 0
-                        details = 'No alert.'
-
-                # Round pred if is an integer variable
-                if isinstance(self.data[m].iloc[-1], int):
-                    real = int(real)
-                    pred = int(round(pred))
-                    pred_table['yhat'] = pred_table['yhat'].round().astype(int)
-                else:
-                    real = round(real, 3)
-                    pred = round(pred, 3)
-                    print(pred)
-            elif method == 'constraint':
-                pred = 'No'
-                liminf = '-'
-                limsup = '-'
-                if pd.isna(real):
-                    details = 'Missing data.**'
-                    is_alert = 1
-                    # Convert the real value to -1.0 so that the remove_decimals function can be applied without error
-                    real = -1.0
-                else:
-                    is_alert = real
-                    real = 'Yes' if real == 1 else 'No'
-                    if is_alert:
-                        details = 'Constraint violated.***'
-                    else:
-                        details = 'No alert.'
-
-            # If we do not want to send an alert for this kpi, then set is_alert to two
-            if model_params.loc[model_params['kpi'] == m, 'sendAlert'].values[0] == 'False' and real != -1.0:
-                is_alert = 2
+                    # The treatment can use the alerts of the previous metrics
+                    alerts_table = self.build_alerts_table(alerts_info, limsup_alert = limsup_alert)
+                    for style_method in PRE_ALERTS_METHODS:
+                        pred, liminf, limsup = style_method(alerts_table, m, pred, liminf, limsup)
 
             # Remove config strings from metrics
             #m = m.replace('__model__', '').replace('__constraint__', '').replace('prophet__', '').replace('arima__', '').replace('related__', '').replace('_', ' ')
             m = m.replace('_', ' ')
 
-            # Create the alert info row for that metric and append it to the general alerts DataFrame
-            single_alert_info = pd.DataFrame({'Metric': [m],
-                                              'Alert': [is_alert],
-                                              'Prediction': [pred],
-                                              'Real': [real],
-                                              'LimInf': [liminf],
-                                              'LimSup': [limsup],
-                                              'Details': [details]})
-            alerts_table = pd.concat([alerts_table, single_alert_info], ignore_index = True)
+            # Save the alert info for that metric
+            alerts_info['Metric'].append(m)
+            alerts_info['Method'].append(method)
+            alerts_info['Real'].append(np.nan if pd.isna(real) else float(real))
+            alerts_info['Prediction'].append(pred)
+            alerts_info['LimInf'].append(liminf)
+            alerts_info['LimSup'].append(limsup)
+            alerts_info['SendAlert'].append(send_alert)
+            alerts_info['IsInteger'].append(is_integer)
             
-            ## Concat predictions to future_table
-            pred_table['ds'] = pd.to_datetime(pred_table['ds']).dt.date
-            # We want only rows from yesterday to the end of the month
-            concat_table = pred_table.loc[pred_table['ds'] >= self.date.date(), ['ds', 'yhat']].reset_index(drop = True)
-            # Every negative value must be zero
-            concat_table.loc[concat_table['yhat'] < 0, 'yhat'] = 0
-            # Rename the columns and concat tables
-            concat_table = concat_table.rename(columns = {'ds': 'Date', 'yhat': 'Prediction'})
-            concat_table['Metric'] = m
-
-            future_table = future_table.append(concat_table, ignore_index = True)
+            ## Save the predictions for the future_table. The constraints do not have predictions
+            if has_model:
+                pred_table['ds'] = pd.to_datetime(pred_table['ds']).dt.date
+                # We want only rows from yesterday to the end of the month
+                concat_table = pred_table.loc[pred_table['ds'] >= self.date.date(), ['ds', 'yhat']].reset_index(drop = True)
+                # Round the future preds if is an integer variable
+                if is_integer:
+                    concat_table['yhat'] = concat_table['yhat'].round().astype(int)
+                # Every negative value must be zero
+                concat_table.loc[concat_table['yhat'] < 0, 'yhat'] = 0
+                # Rename the columns
+                concat_table = concat_table.rename(columns = {'ds': 'Date', 'yhat': 'Prediction'})
+                concat_table.insert(1, 'Metric', m)
+
+                future_frames.append(concat_table)
         
+        # Concat the predictions of every metric
+        if len(future_frames) > 0:
+            future_table = pd.concat(future_frames, ignore_index = True)
+        else:
+            future_table = pd.DataFrame(columns = ['Date', 'Metric', 'Prediction'])
+
+        # Create the alerts table with the info of every metric
+        alerts_table = self.build_alerts_table(alerts_info, limsup_alert = limsup_alert)
+
         # Remove or keep the decimals depending on the metric type
         # In order to have different types of numbers in the same column, the columns must be converted to string
-        alerts_table['Prediction'] = alerts_table['Prediction'].astype(str).apply(self.remove_decimals)
-        alerts_table['Real'] = alerts_table['Real'].astype(str).apply(self.remove_decimals)
+        alerts_table['Prediction'] = self.remove_decimals(alerts_table['Prediction'])
+        alerts_table['Real'] = self.remove_decimals(alerts_table['Real'])
 
         # Every -1 is set as 'No data'
         alerts_table.loc[alerts_table['Real'] == '-1', 'Real'] = 'No data'
@@ -305,31 +524,91 @@ class AlertDetector():
 
         return alerts_table, future_table
 
-    def remove_decimals(self, number):
+    def build_alerts_table(self, alerts_info, limsup_alert = False):
+        """
+        Function to create the table with the summary of the alerts from the info of every metric.
+        All the metrics are evaluated at once: when the actual yesterday's data is below or above
+        the limits of the confidence interval, an alert will exist.
+
+        :param alerts_info: The name, method, real value, prediction, limits, if the alert has to be sent and if the metric is an integer for every metric.
+        :type alerts_info: dict
+        :param limsup_alert: True if alerts above limsup must be detected.
+        :type limsup_alert: boolean
+        """
+
+        method = np.array(alerts_info['Method'], dtype = object)
+        real = np.array(alerts_info['Real'], dtype = float)
+        pred = np.array(alerts_info['Prediction'], dtype = float)
+        liminf = np.array(alerts_info['LimInf'], dtype = float)
+        limsup = np.array(alerts_info['LimSup'], dtype = float)
+        send_alert = np.array(alerts_info['SendAlert'], dtype = bool)
+        is_integer = np.array(alerts_info['IsInteger'], dtype = bool)
+
+        is_constraint = method == 'constraint'
+        is_missing = np.isnan(real)
+
+        # We cannot have negative predictions
+        pred = np.where(pred < 0, 0.0, pred)
+
+        # We cannot have negative lims and if pred is 0, then liminf also must be zero
+        liminf = np.where((liminf < 0) | (pred == 0), 0.0, liminf)
+        limsup = np.where(limsup < 0, 0.0, limsup)
+
+        # Save if it is an alert or not and save the details
+        decreasing = ~is_constraint & ~is_missing & (real < liminf)
+        increasing = ~is_constraint & ~is_missing & ~decreasing & (real > limsup) & limsup_alert
+        violated = is_constraint & ~is_missing & (real != 0)
+        details = np.select([is_missing, decreasing, increasing, violated],
+                            ['Missing data.**', 'Decreasing tendency.*', 'Increasing tendency.*', 'Constraint violated.***'],
+                            default = 'No alert.')
+        is_alert = np.where(is_missing | decreasing | increasing, 1, 0)
+        # For the constraints, the real value says if it is an alert or not
+        is_alert = np.where(is_constraint & ~is_missing, np.nan_to_num(real), is_alert).astype(int)
+
+        # Convert the missing real values to -1.0 so that they are shown as -1 after removing the decimals
+        real = np.where(is_missing, -1.0, real)
+
+        # If we do not want to send an alert for this kpi, then set is_alert to two
+        is_alert = np.where(~send_alert & (real != -1.0), 2, is_alert)
+
+        # Round pred and real if they are integer variables
+        pred = np.where(is_integer, np.round(pred), np.round(pred, 3))
+        real = np.where(is_integer, np.trunc(real), np.round(real, 3))
+
+        # The constraints do not have predictions, only if they are violated or not
+        constraint_real = np.where(real == 1, 'Yes', 'No')
+        alerts_table = pd.DataFrame({'Metric': alerts_info['Metric'],
+                                     'Alert': is_alert,
+                                     'Prediction': np.where(is_constraint, 'No', pred.astype(object)),
+                                     'Real': np.where(is_constraint & ~is_missing, constraint_real, real.astype(object)),
+                                     'LimInf': np.where(is_constraint, '-', liminf.astype(object)),
+                                     'LimSup': np.where(is_constraint, '-', limsup.astype(object)),
+                                     'Details': details})
+
+        return alerts_table
+
+    def remove_decimals(self, column):
         """
         Function to remove decimals from metrics that should not have them.
-        They must have been converted to string before.
+        The column can have numbers and strings, and it is returned as a string column.
         
-        :param number: The number to remove the decimals.
-        :type number: string
+        :param column: The column with the numbers to remove the decimals.
+        :type column: Pandas Series
         """
 
-        # Split the number in two parts: before and after the decimal point
-        number_split = number.split('.')
-        # Sum all decimals
-        try:
-            decimals_sum = sum(int(d) for d in number_split[1])
-        except IndexError:
-            return number
-        # Check if sum of decimals is zero. If it is, then the number can be converted to integer
-        if decimals_sum == 0:
-            return number_split[0]
-        else:
-            return number
+        # The strings are converted to nan, so they are never integers
+        numbers = pd.to_numeric(column, errors = 'coerce').to_numpy(dtype = float)
+        # Check if the decimals are zero. If they are, then the number can be converted to integer
+        is_int = np.mod(numbers, 1) == 0
+        int_numbers = np.where(is_int, numbers, 0).astype(np.int64).astype(str)
+
+        return pd.Series(np.where(is_int, int_numbers, column.astype(str)), index = column.index)
         
-    def calculate_days_remaining_month(self):
+    @cached_property
+    def days_remaining_month(self):
         """
-        This function calculates the remaining days until the end of the month that correspond to the date.
+        This property calculates the remaining days until the end of the month that correspond to the date.
+        It is calculated only once because the date does not change.
         """
         # Obtain first day of the next month
         first_day_next_month = datetime.date(self.date.year, self.date.month, 1) + datetime.timedelta(days = 31)
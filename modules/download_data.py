@@ -6,14 +6,77 @@ for both sources.
 from config.alerts_table_styles.extra_styles import ExtraStylesBQ
 from config.alerts_table_styles.extra_styles import ExtraStylesPred
 from config.alerts_table_styles.extra_styles import ExtraStylesEvaluation
+from modules.extra_styles import get_extra_styles_methods
 from apiclient.discovery import build
 from google.oauth2.service_account import Credentials
 from google.cloud import bigquery
+from google.cloud import bigquery_storage
 import pandas as pd
-import time
 from google.api_core.exceptions import NotFound
 from google.api_core.exceptions import BadRequest
 import logging
+import threading
+import io
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Maximum number of rows in every page of a GA report and retries of every GA request
+GA_PAGE_SIZE = 10000
+GA_NUM_RETRIES = 5
+
+# The extra styles methods of the BQ tables
+BQ_METHODS = get_extra_styles_methods(ExtraStylesBQ)
+PRED_METHODS = get_extra_styles_methods(ExtraStylesPred)
+EVALUATION_METHODS = get_extra_styles_methods(ExtraStylesEvaluation)
+
+# Arrow types of the BQ field types, used to write the tables to Parquet with the types of the BQ schema
+ARROW_TYPES = {
+    'STRING': pa.string(),
+    'FLOAT': pa.float64(),
+    'FLOAT64': pa.float64(),
+    'INTEGER': pa.int64(),
+    'INT64': pa.int64(),
+    'BOOLEAN': pa.bool_(),
+    'BOOL': pa.bool_(),
+    'DATE': pa.date32(),
+    'DATETIME': pa.timestamp('us'),
+    'TIMESTAMP': pa.timestamp('us', tz = 'UTC')
+}
+
+def _to_parquet(table, schema):
+    """
+    Function to write a table to an in-memory Parquet file.
+    The columns in the schema are cast to the type of their BQ field, the rest keep the inferred type.
+    The values that are not numbers in the numeric columns (e.g. 'No' in the constraints predictions) are saved as null.
+
+    :param table: The table to write.
+    :type table: Pandas DataFrame
+    :param schema: The BQ schema of the table.
+    :type schema: list
+    """
+
+    # The strings cannot be cast to numbers or dates by pyarrow, they are converted with pandas
+    table = table.copy()
+    for field in schema:
+        if field.name not in table.columns or table[field.name].dtype != 'object':
+            continue
+        if field.field_type in ['FLOAT', 'FLOAT64', 'INTEGER', 'INT64']:
+            table[field.name] = pd.to_numeric(table[field.name], errors = 'coerce')
+        elif field.field_type == 'DATE':
+            table[field.name] = pd.to_datetime(table[field.name]).dt.date
+
+    arrow_table = pa.Table.from_pandas(table, preserve_index = False)
+    for field in schema:
+        arrow_type = ARROW_TYPES.get(field.field_type)
+        if arrow_type is not None and field.name in arrow_table.column_names:
+            i = arrow_table.column_names.index(field.name)
+            arrow_table = arrow_table.set_column(i, field.name, arrow_table.column(i).cast(arrow_type))
+
+    buffer = io.BytesIO()
+    pq.write_table(arrow_table, buffer, compression = 'snappy')
+    buffer.seek(0)
+
+    return buffer
 
 class DownloadData():
     """This class has the necessary methods to download the data to make the analysis."""
@@ -27,21 +90,37 @@ class DownloadData():
         """
         
         self.token_path = token_path
+
+        # The credentials and clients are created only once and reused in every call
+        self._lock = threading.Lock()
+        self._ga_credentials = None
+        self._ga_services = threading.local()
+        self._bq_clients = {}
+        self._bqstorage_client = None
     
     def get_service_GA(self):
         """
         Function to get the service connection to GA.
         """
 
+        # The GA service is not thread-safe, so every thread has its own service
+        service = getattr(self._ga_services, 'service', None)
+        if service is not None:
+            return service
+
         # Set the scopes
         SCOPES = ['https://www.googleapis.com/auth/analytics.readonly']
         
-        credentials = Credentials.from_service_account_file(
-            self.token_path, scopes = SCOPES
-        )
+        # The token file is read only once
+        with self._lock:
+            if self._ga_credentials is None:
+                self._ga_credentials = Credentials.from_service_account_file(
+                    self.token_path, scopes = SCOPES
+                )
 
         # Initialize GA service to download data
-        service = build(serviceName = 'analyticsreporting', version = 'v4', credentials = credentials)
+        service = build(serviceName = 'analyticsreporting', version = 'v4', credentials = self._ga_credentials)
+        self._ga_services.service = service
 
         return service
     
@@ -60,13 +139,21 @@ class DownloadData():
         metrics = [m['name'] for m in report['columnHeader']['metricHeader']['metricHeaderEntries']]
         headers = [*dimensions, *metrics]
         
-        # Gather the data and convert them to the rows of the table
+        # Gather the data and convert them to the columns of the table
         data_rows = report['data']['rows']
-        data = []
+        columns = [[] for _ in headers]
+        n_dimensions = len(dimensions)
         for row in data_rows:
-            data.append([*row['dimensions'], *row['metrics'][0]['values']])
+            for i, value in enumerate(row['dimensions']):
+                columns[i].append(value)
+            for i, value in enumerate(row['metrics'][0]['values']):
+                columns[n_dimensions + i].append(value)
         
-        return pd.DataFrame(data = data, columns = headers)
+        # The dimensions are kept as strings and the metrics, which GA sends as strings, are converted to numbers
+        data = {header: column for header, column in zip(dimensions, columns[:n_dimensions])}
+        data.update({header: pd.to_numeric(column, errors = 'coerce') for header, column in zip(metrics, columns[n_dimensions:])})
+
+        return pd.DataFrame(data, columns = headers)
 
     def get_data_GA(self, view_id, start_date, end_date, metrics_input, dimensions_input, segments_input = [], filters_input = ''):
         """
@@ -91,33 +178,46 @@ class DownloadData():
         # Initialize the service
         service = self.get_service_GA()
 
-        # Download the raw data as a dictionary
-        response = service.reports().batchGet(
-                    body={
-                        'reportRequests': [{
-                            'viewId': view_id,
-                            'dateRanges': [{'startDate': start_date, 'endDate': end_date}],
-                            'metrics': [{'expression': 'ga:' + m} for m in metrics_input],
-                            'dimensions': [{'name': 'ga:' + d} for d in dimensions_input],
-                            'segments': [{'segmentId': s} for s in segments_input],
-                            'dimensionFilterClauses': filters_input
-                        }]
-                    }).execute()
-
-        # Convert data to Pandas DataFrame
-        data = self.res_to_df(response)
+        # Download the raw data as a dictionary. The report can have several pages, all of them are downloaded
+        pages = []
+        page_token = None
+        while True:
+            report_request = {
+                'viewId': view_id,
+                'dateRanges': [{'startDate': start_date, 'endDate': end_date}],
+                'metrics': [{'expression': 'ga:' + m} for m in metrics_input],
+                'dimensions': [{'name': 'ga:' + d} for d in dimensions_input],
+                'segments': [{'segmentId': s} for s in segments_input],
+                'dimensionFilterClauses': filters_input,
+                'pageSize': GA_PAGE_SIZE
+            }
+            if page_token is not None:
+                report_request['pageToken'] = page_token
+
+            response = service.reports().batchGet(
+                        body = {'reportRequests': [report_request]},
+                        # Only the fields used to build the table are downloaded
+                        fields = 'reports(columnHeader(dimensions,metricHeader/metricHeaderEntries/name),data/rows(dimensions,metrics/values),nextPageToken)'
+                        # The request is retried with exponential backoff if the quota is exceeded (429) or there is a server error
+                        ).execute(num_retries = GA_NUM_RETRIES)
+
+            # Convert data to Pandas DataFrame
+            pages.append(self.res_to_df(response))
+
+            page_token = response['reports'][0].get('nextPageToken')
+            if page_token is None:
+                break
+
+        data = pd.concat(pages, ignore_index = True)
 
         # The date is in format YYYYMMDD, it must be in format YYYY-MM-DD
-        data['ga:date'] = data['ga:date'].apply(lambda x: x[:4] + '-' + x[4:6] + '-' + x[6:])
+        data['ga:date'] = data['ga:date'].str[:4] + '-' + data['ga:date'].str[4:6] + '-' + data['ga:date'].str[6:]
         
-        # Data can be downloaded as an string while they are a number. They have to be
-        # converted into float or integer, depending on the type o number
+        # The metrics are already numbers. They have to be integer if all their values are integer,
+        # otherwise they are kept as float. It is decided after joining all the pages of the report
         for col in ['ga:' + m for m in metrics_input]:
-            if data[col].dtype == 'object':
-                if data[col].str.contains('\.').any():
-                    data[col] = data[col].astype(float)
-                else:
-                    data[col] = data[col].astype('Int64')
+            if (data[col].dropna() % 1 == 0).all():
+                data[col] = data[col].astype('Int64')
 
         #data = data.drop(columns = 'ga:segment', axis = 1)
 
@@ -131,28 +231,51 @@ class DownloadData():
         :type location: string
         """
 
-        # Set the BQ client
-        try:
-            client = bigquery.Client.from_service_account_json(self.token_path, location = location)
-        except FileNotFoundError:
-            client = bigquery.Client(location = location)
+        # Set the BQ client. There is only one client for every location
+        with self._lock:
+            if location not in self._bq_clients:
+                try:
+                    client = bigquery.Client.from_service_account_json(self.token_path, location = location)
+                except FileNotFoundError:
+                    client = bigquery.Client(location = location)
+                self._bq_clients[location] = client
         
-        return client
+        return self._bq_clients[location]
 
+    def logging_bqstorage(self):
+        """
+        Function to log into the BQ Storage API, which downloads the query results in Arrow format.
+        """
+
+        # Set the BQ Storage client. It is created only once
+        with self._lock:
+            if self._bqstorage_client is None:
+                try:
+                    credentials = Credentials.from_service_account_file(self.token_path, scopes = ['https://www.googleapis.com/auth/cloud-platform'])
+                    self._bqstorage_client = bigquery_storage.BigQueryReadClient(credentials = credentials)
+                except FileNotFoundError:
+                    self._bqstorage_client = bigquery_storage.BigQueryReadClient()
+
+        return self._bqstorage_client
     
-    def get_data_BQ(self, sql_query_input):
+    def get_data_BQ(self, sql_query_input, use_bqstorage_api = False):
         """
         Function to download data from BQ.
 
         :param sql_query_input: The sql query to download the specific metric.
         :type sql_query_input: string
+        :param use_bqstorage_api: True if the results must be downloaded with the BQ Storage API, which is faster than the REST API.
+        :type use_bqstorage_api: boolean
         """
         
         # Set the BQ client
         client = self.logging_bq()
 
         # Download data
-        data = client.query(sql_query_input).to_dataframe()
+        if use_bqstorage_api:
+            data = client.query(sql_query_input).to_dataframe(bqstorage_client = self.logging_bqstorage())
+        else:
+            data = client.query(sql_query_input).to_dataframe(create_bqstorage_client = False)
 
         return data
     
@@ -175,13 +298,8 @@ class DownloadData():
         dataset_id = 'alerts_historical_dataset_' + env
         table_id = 'alerts_historical_table_' + env
 
-        extra_styles_inst = ExtraStylesBQ()
-        extra_styles_methods = [name_method for name_method in dir(extra_styles_inst) if callable(getattr(extra_styles_inst, name_method)) and not '__' in name_method]
-        if len(extra_styles_methods) > 1:
-                extra_styles_methods.remove('do_nothing')
-        for name_method in extra_styles_methods:
-                method = getattr(extra_styles_inst, name_method)
-                new_hist, schema = method(new_hist)
+        for method in BQ_METHODS:
+            new_hist, schema = method(new_hist)
 
         # Create the datasets and table refs
         dataset_ref = client.dataset(dataset_id, project = project_id)
@@ -195,18 +313,17 @@ class DownloadData():
         table = bigquery.Table(table_ref, schema = schema)
         client.create_table(table, exists_ok = True)
 
-        # Convert the pandas DataFrame to dict in order to insert new rows
-        rows_to_insert = new_hist.to_dict('records')
-        # The rows insertion can fail the first time because there is not enough time to create the table.
-        # Then we use a while loop and a try-except clause
-        while True:
-            try:
-                client.insert_rows(table, rows_to_insert)
-                break
-            except NotFound:
-                time.sleep(2)
-            except BadRequest:
-                break
+        # Append the new alerts with a load job from a Parquet file, which already has the types of the schema
+        job_config = bigquery.LoadJobConfig(
+            write_disposition = bigquery.WriteDisposition.WRITE_APPEND,
+            source_format = bigquery.SourceFormat.PARQUET,
+        )
+
+        try:
+            job = client.load_table_from_file(_to_parquet(new_hist, schema), table_ref, job_config = job_config)
+            job.result()
+        except BadRequest as e:
+            logging.warning('The alerts could not be inserted in ' + table_id + ': ' + str(e))
 
     def upload_future_pred(self, project_id, future_table, env, date):
         """
@@ -237,13 +354,8 @@ class DownloadData():
         # Add initial date predictions column
         future_table['Date_init'] = date.date()#.strftime('%Y-%m-%d')
 
-        extra_styles_inst = ExtraStylesPred()
-        extra_styles_methods = [name_method for name_method in dir(extra_styles_inst) if callable(getattr(extra_styles_inst, name_method)) and not '__' in name_method]
-        if len(extra_styles_methods) > 1:
-                extra_styles_methods.remove('do_nothing')
-        for name_method in extra_styles_methods:
-                method = getattr(extra_styles_inst, name_method)
-                future_table, schema, query_upsert = method(future_table, bq_table_name, bq_table_temp)
+        for method in PRED_METHODS:
+            future_table, schema, query_upsert = method(future_table, bq_table_name, bq_table_temp)
 
         # Create the datasets and table refs
         dataset_ref = client.dataset(dataset_id, project = project_id)
@@ -282,12 +394,13 @@ class DownloadData():
 
         # We append new data by doing an upsert because we can execute the same prediction in the same day
 
+        # The table is loaded from a Parquet file, which already has the types of the schema
         job_config = bigquery.LoadJobConfig(
             write_disposition = bigquery.WriteDisposition.WRITE_TRUNCATE,
-            schema = schema,
+            source_format = bigquery.SourceFormat.PARQUET,
         )
 
-        job = client.load_table_from_dataframe(future_table, bq_table_temp, job_config = job_config)
+        job = client.load_table_from_file(_to_parquet(future_table, schema), bq_table_temp, job_config = job_config)
         job.result()
 
         job = client.query(query_upsert)
@@ -320,13 +433,8 @@ class DownloadData():
         pred_table_name = project_id + '.' + dataset_id + '.' + table_id
 
         # Set the styles of evaluation metrics table
-        extra_styles_inst = ExtraStylesEvaluation()
-        extra_styles_methods = [name_method for name_method in dir(extra_styles_inst) if callable(getattr(extra_styles_inst, name_method)) and not '__' in name_method]
-        if len(extra_styles_methods) > 1:
-                extra_styles_methods.remove('do_nothing')
-        for name_method in extra_styles_methods:
-                method = getattr(extra_styles_inst, name_method)
-                query_evaluation = method(pred_table_name = pred_table_name, date = date.strftime('%Y_%m_%d'))
+        for method in EVALUATION_METHODS:
+            query_evaluation = method(pred_table_name = pred_table_name, date = date.strftime('%Y_%m_%d'))
 
         # Upload evaluation metrics table
         try:
@@ -5,6 +5,7 @@ This module uses the final alerts table summary to generate an email with the al
 from datetime import datetime
 from google.cloud import bigquery
 from config.alerts_table_styles.extra_styles import ExtraStylesAlerts
+from modules.extra_styles import get_extra_styles_methods
 import smtplib
 import ssl
 from email.mime.text import MIMEText
@@ -22,6 +23,16 @@ from openpyxl.utils import column_index_from_string, get_column_letter
 from openpyxl.drawing.image import Image
 import os
 
+# The extra styles methods of the alerts table
+ALERTS_METHODS = get_extra_styles_methods(ExtraStylesAlerts)
+
+# The footnotes of the alerts table and the details of the alerts that need them
+DETAILS_FOOTNOTES = [
+    ({'Decreasing tendency.*', 'Increasing tendency.*'}, '*It is possible that your yesterday\'s data should be higher or lower given the historical behavior of the metric. Please check if your data is changing the tendency.'),
+    ({'Missing data.**'}, '**Your yesterday\'s data is missed. Please check it there is a problem in the BQ extraction.'),
+    ({'Constraint violated.***'}, '***The constraint in the Metric column is violated. Please check your metrics.')
+]
+
 class EmailGenerator():
     """
     This class creates the email corpus, sets the smtp service with email and sends the email with the alerts.
@@ -49,6 +60,22 @@ class EmailGenerator():
         self.port = port
         self.smtp_server = smtp_server
 
+        # The css styles and the logo of the alerts table are read only once
+        with open('./config/alerts_table_styles/style.css', 'r') as f:
+            self.styles = f.read()
+
+        # You must save the logo in config/alerts_table_styles as a png image
+        try:
+            with open('./config/alerts_table_styles/logo.png', 'rb') as f:
+                self.logo = MIMEImage(f.read())
+            self.logo.add_header('Content-ID', '<logo>')
+            self.logo.add_header("Content-Disposition", "inline; filename=logo.png")
+        except FileNotFoundError:
+            self.logo = None
+
+        # The connection with the email service is opened when the first email is sent
+        self.server = None
+
     def create_corpus(self, only_alerts_table, date, alerts_table_title, future_table = None):
         """
         Function to create the corpus of the email. If any alert is detected, the corpus is created with a message and
@@ -81,34 +108,16 @@ class EmailGenerator():
 
             text = f'<p style="font-size: 16px;">{text}</p>'
 
-            # Add css styles
-            with open('./config/alerts_table_styles/style.css', 'r') as f:
-                styles = f.read()
-
-            # Add the logo to the alerts table. You must save the logo in config/alerts_table_styles as a png image
-            try:
-                with open('./config/alerts_table_styles/logo.png', 'rb') as f:
-                    img_data = f.read()
-                    logo = MIMEImage(img_data)
-                    logo.add_header('Content-ID', '<logo>')
-                    logo.add_header("Content-Disposition", "inline; filename=logo.png")
-                    msg.attach(logo)
-                
+            # Add the logo to the alerts table if it exists
+            if self.logo is not None:
+                msg.attach(self.logo)
                 logo_html_part = '<img src="cid:logo" alt="Logotipo" class="logo" />'
-            except FileNotFoundError:
+            else:
                 logo_html_part = ''
             
             # Convert the table to html
             # The extra styles will be applied whenever new methods in ExtraStylesAlerts are created
-            extra_styles_inst = ExtraStylesAlerts()
-            table_html_fin = ''
-            extra_styles_methods = [name_method for name_method in dir(extra_styles_inst) if callable(getattr(extra_styles_inst, name_method)) and not '__' in name_method]
-            if len(extra_styles_methods) > 1:
-                extra_styles_methods.remove('do_nothing')
-            for name_method in extra_styles_methods:
-                method = getattr(extra_styles_inst, name_method)
-                table_html = method(only_alerts_table)
-                table_html_fin = table_html_fin + table_html + '<br>'
+            table_html_fin = ''.join(method(only_alerts_table) + '<br>' for method in ALERTS_METHODS)
 
             # Set the title of the alerts table
             title_text = alerts_table_title
@@ -126,35 +135,18 @@ class EmailGenerator():
             table_html = header_html + table_html_fin + "</div>"
 
             # Apply the css styles in line
-            table_html_with_styles = f"<style>{styles}</style>{table_html}"
-
-            # Convert the CSS styles into line styles
-            table_html = transform(table_html_with_styles)
-
-            # Add the alerts details below the table
-            if only_alerts_table['Details'].isin(['Decreasing tendency.*', 'Increasing tendency.*']).any():
-                details_tendency = '*It is possible that your yesterday\'s data should be higher or lower given the historical behavior of the metric. Please check if your data is changing the tendency.'
-            else:
-                details_tendency = ''
+            table_html_with_styles = f"<style>{self.styles}</style>{table_html}"
 
-            details_tendency = f'<p style="font-size: 13px;">{details_tendency}</p>'
+            # Convert the CSS styles into line styles. The styles are not validated and no external files are downloaded
+            table_html = transform(table_html_with_styles, disable_validation = True, allow_network = False)
 
-            if only_alerts_table['Details'].isin(['Missing data.**']).any():
-                details_missing = '**Your yesterday\'s data is missed. Please check it there is a problem in the BQ extraction.'
-            else:
-                details_missing = ''
-            
-            details_missing = f'<p style="font-size: 13px;">{details_missing}</p>'
-
-            if only_alerts_table['Details'].isin(['Constraint violated.***']).any():
-                details_constraint = '***The constraint in the Metric column is violated. Please check your metrics.'
-            else:
-                details_constraint = ''
-
-            details_constraint = f'<p style="font-size: 13px;">{details_constraint}</p>'
+            # Add the alerts details below the table. Every footnote is added if any alert has one of its details
+            details_set = set(only_alerts_table['Details'].unique())
+            details_html = ''.join(f'<p style="font-size: 13px;">{footnote if details_set & details else ""}</p>'
+                                   for details, footnote in DETAILS_FOOTNOTES)
 
             # Join all elements to create the corpus
-            corpus = MIMEText(text + table_html + details_tendency + details_missing + details_constraint, 'html')
+            corpus = MIMEText(text + table_html + details_html, 'html')
 
             msg.attach(corpus)
 
@@ -248,8 +240,17 @@ class EmailGenerator():
     def set_email_service(self):
         """
         Function to set the connection with email service.
+        The connection is reused while the server keeps it open.
         """
 
+        # Check if the current connection is still open
+        if self.server is not None:
+            try:
+                self.server.noop()
+                return self.server
+            except smtplib.SMTPServerDisconnected:
+                self.server = None
+
         # Create the connection with ssl and smtp protocol
         # The credentials and email info from the config are used
         context = ssl.create_default_context()
@@ -257,6 +258,7 @@ class EmailGenerator():
         server = smtplib.SMTP(self.smtp_server, self.port)
         server.starttls(context = context)
         server.login(self.email_from, self.password)
+        self.server = server
 
         return server
     
@@ -269,5 +271,23 @@ class EmailGenerator():
         """
 
         server = self.set_email_service()
-        server.send_message(msg)
+        try:
+            server.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # The server has closed the connection, so a new one is opened and the email is sent again
+            self.server = None
+            server = self.set_email_service()
+            server.send_message(msg)
+
+    def close(self):
+        """
+        Function to close the connection with the email service.
+        """
+
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except smtplib.SMTPServerDisconnected:
+                pass
+            self.server = None
 
@@ -0,0 +1,23 @@
+"""
+This module finds the methods that the user has added to the extra styles classes of the config.
+They are found only once, when the modules that apply them are imported.
+"""
+
+import inspect
+
+def get_extra_styles_methods(extra_styles_class):
+    """
+    Function to get the methods of an extra styles class, bound to a new instance of the class.
+    The do_nothing method is only returned if there are no other methods.
+
+    :param extra_styles_class: The extra styles class of the config.
+    :type extra_styles_class: class
+    """
+
+    extra_styles_inst = extra_styles_class()
+    extra_styles_methods = [(name_method, method) for name_method, method in inspect.getmembers(extra_styles_inst, predicate = callable)
+                            if not name_method.startswith('__')]
+    if len(extra_styles_methods) > 1:
+        extra_styles_methods = [(name_method, method) for name_method, method in extra_styles_methods if name_method != 'do_nothing']
+
+    return tuple(method for _, method in extra_styles_methods)
@@ -7,6 +7,7 @@ with more techniques as the project progresses.
 import numpy as np
 import pandas as pd
 import logging
+import warnings
 
 class Preprocess():
     """
@@ -21,24 +22,18 @@ class Preprocess():
         """
 
         # Save the metrics in a list and discard date from missing data imputation
+        # The metrics with all values as null are not filled, so that they are shown as missing data
         metrics = data.drop('date', axis = 1).columns
+        metrics = metrics[data[metrics].notna().any(axis = 0).to_numpy()]
 
-        # Impute missing data for every column. Every column is a time series
-        for m in metrics:
-            # Implement the moving average
-            data['moving_avg'] = data[m].rolling(window = 7, min_periods = 1).mean()
-            # If the variable has integer values, then we round the moving average to integers
-            data['moving_avg'] = data['moving_avg'].fillna(0)
-            if data[m].dtypes == 'Int64':
-                data['moving_avg'] = data['moving_avg'].round().astype(int)
-            # If the last value is NA, is preferable not to fill it because the System would send a wrong real value
-            # Then, we assign it to zero (equal to no data)
-            #if pd.isna(data.iloc[-1, data.columns.get_loc(m)]):
-            #    data.iloc[-1, data.columns.get_loc(m)] = 0
-            data[m] = np.where(data[m].isna(), data['moving_avg'], data[m])
-            # If you replace missing data, it could have integer values mixed with float. So all of them are converted to float
-            #data[m] = data[m].astype(float)
-            data = data.drop('moving_avg', axis = 1)
+        # Impute missing data for all the columns at once. Every column is a time series
+        # Implement the moving average
+        moving_avg = data[metrics].rolling(window = 7, min_periods = 1).mean().fillna(0)
+        # If the variable has integer values, then we round the moving average to integers
+        int_metrics = metrics[data[metrics].dtypes == 'Int64']
+        moving_avg[int_metrics] = moving_avg[int_metrics].round().astype('Int64')
+        # Fill only the missing values with the moving average
+        data[metrics] = data[metrics].where(data[metrics].notna(), moving_avg)
 
         return data
     
@@ -52,19 +47,21 @@ class Preprocess():
         # Save the metrics in a list and discard date from missing data imputation
         metrics = data.drop('date', axis = 1).columns
 
-        for m in metrics:
-            # Calculate mean and std for every metric
-            mean = np.mean(data[m])
-            std = np.std(data[m])
+        # Every metric is a column of the same float matrix, so all of them are processed at once
+        values = data[metrics].to_numpy(dtype = float, na_value = np.nan)
+
+        # Calculate mean and std for every metric. Metrics without data have no limits
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category = RuntimeWarning)
+            mean = np.nanmean(values, axis = 0)
+            std = np.nanstd(values, axis = 0)
+
+        # Set the limits to detect outliers
+        lower_limit = mean - 3*std
+        upper_limit = mean + 3*std
+
+        # Every outlier data is converted to NA. The original type of every metric is kept
+        condition = (values < lower_limit) | (values > upper_limit)
+        data[metrics] = data[metrics].mask(condition)
 
-            # Set the limits to detect outliers
-            lower_limit = mean - 3*std
-            upper_limit = mean + 3*std
-    
-            # Every outlier data is converted to NA, except the last row which corresponds to yesterday's actual data
-            condition = (data[m] < lower_limit) | (data[m] > upper_limit)
-            #aux = data.iloc[:-1]
-            #aux.loc[condition, m] = None
-            #data = pd.concat([aux, data.iloc[-1:]])
-            data.loc[condition, m] = None
         return data
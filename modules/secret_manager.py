@@ -1,14 +1,14 @@
 from google.cloud import secretmanager
 from google.oauth2.service_account import Credentials
+from functools import lru_cache
+import logging
 
-def get_secret(project_id, secret, token_path):
+@lru_cache(maxsize = None)
+def _get_sm_client(token_path):
     """
-    Function to read secrets from the Google Cloud Secret Manager.
+    Function to create the client of the Google Cloud Secret Manager.
+    Only one client is created for every token.
 
-    :param project_id: The project id.
-    :type project_id: string
-    :param secret: The name of the secret to read.
-    :type secret: string
     :param token_path: The path of the token that will connect to Google Cloud project.
     :type token_path: string
     """
@@ -17,10 +17,56 @@ def get_secret(project_id, secret, token_path):
         client = secretmanager.SecretManagerServiceClient(credentials = creds)
     except FileNotFoundError:
         client = secretmanager.SecretManagerServiceClient()
+    return client
+
+@lru_cache(maxsize = 128)
+def _read_secret(project_id, secret, token_path):
+    """
+    Function to read a single secret from the Google Cloud Secret Manager.
+    Every secret is read only once, the next calls return the saved value. The errors are raised, so they are not saved.
+
+    :param project_id: The project id.
+    :type project_id: string
+    :param secret: The name of the secret to read.
+    :type secret: string
+    :param token_path: The path of the token that will connect to Google Cloud project.
+    :type token_path: string
+    """
+    client = _get_sm_client(token_path)
     secret_path = f'projects/{project_id}/secrets/{secret}/versions/latest'
+    response = client.access_secret_version(request = {'name': secret_path})
+    return response.payload.data.decode('UTF-8')
+
+def get_secret(project_id, secret, token_path):
+    """
+    Function to read secrets from the Google Cloud Secret Manager.
+    Every secret is read only once, the next calls return the saved value.
+    If it cannot be read, None is returned and it will be read again in the next call.
+
+    :param project_id: The project id.
+    :type project_id: string
+    :param secret: The name of the secret to read.
+    :type secret: string
+    :param token_path: The path of the token that will connect to Google Cloud project.
+    :type token_path: string
+    """
     try:
-        response = client.access_secret_version(request = {'name': secret_path})
-        return response.payload.data.decode('UTF-8')
-    except Exception as e:
-        print('SecretManager Error: ' + e)
-        return None
\ No newline at end of file
+        return _read_secret(project_id, secret, token_path)
+    except Exception:
+        logging.exception('SecretManager Error reading the secret ' + secret)
+        return None
+
+def get_secrets(project_id, secrets, token_path):
+    """
+    Function to read several secrets from the Google Cloud Secret Manager.
+    The same client (and connection) is used to read all of them.
+
+    :param project_id: The project id.
+    :type project_id: string
+    :param secrets: The names of the secrets to read.
+    :type secrets: list
+    :param token_path: The path of the token that will connect to Google Cloud project.
+    :type token_path: string
+    :return: The values of the secrets, in the same order as the names.
+    """
+    return [get_secret(project_id, secret, token_path) for secret in secrets]
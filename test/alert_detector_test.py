@@ -0,0 +1,66 @@
+from ..modules import alert_detector
+from ..modules.alert_detector import AlertDetector
+from ..modules.preprocess import Preprocess
+import unittest
+from unittest import mock
+import datetime
+import tempfile
+import pandas as pd
+import numpy as np
+
+class TestAlertDetector(unittest.TestCase):
+
+    def test_prediction_PROPHET_constant(self):
+        # Create a constant time series. The metrics without data are filled with zeros in the preprocess
+        data = pd.DataFrame({
+            'date': pd.date_range('2022-01-01', periods = 119).strftime('%Y-%m-%d'),
+            'metric1': np.zeros(119)
+        })
+
+        # Fit the model for two consecutive days, so the second fit is warm-started with the saved params
+        # No exception must be raised
+        with tempfile.TemporaryDirectory() as warm_start_folder, mock.patch.object(alert_detector, 'WARM_START_FOLDER', warm_start_folder):
+            for n_days in [118, 119]:
+                detector = AlertDetector(data = data.iloc[:n_days], plot = False,
+                                         date = datetime.datetime(2022, 1, 1, 9, 0) + datetime.timedelta(days = n_days))
+                pred_table = detector.get_prediction_PROPHET('metric1')
+
+        # Check that there are predictions for the rest of the month
+        self.assertFalse(pred_table['yhat'].isna().any())
+
+
+    def test_alerts_table_null_metric(self):
+        # Create sample data with a metric that has all values as null
+        data = pd.DataFrame({
+            'date': pd.date_range('2022-01-01', periods = 120).strftime('%Y-%m-%d'),
+            'metric1': np.arange(120, dtype = float),
+            'metric2': np.nan
+        })
+        model_params = pd.DataFrame({
+            'kpi': ['metric1', 'metric2'],
+            'method': 'prophet',
+            'isRelated': 'False',
+            'confInt': 95,
+            'seasonMode': 'additive',
+            'sendAlert': 'True',
+            'changePrior': 0.5
+        })
+
+        # Divide data into model data and yesterday's actual data and impute the missing data as the System does
+        real_value_table = data.iloc[[-1]]
+        preprocess = Preprocess()
+        model_data = preprocess.fill_moving_avg(preprocess.remove_outliers(data.iloc[:-1].copy()))
+
+        # Detect the alerts
+        detector = AlertDetector(data = model_data, plot = False, date = datetime.datetime(2022, 4, 30, 9, 0))
+        with tempfile.TemporaryDirectory() as warm_start_folder, mock.patch.object(alert_detector, 'WARM_START_FOLDER', warm_start_folder):
+            alerts_table, future_table = detector.get_alerts_table(real_value_table, model_params = model_params, future_pred = True)
+
+        # Check that the null metric is shown as missing data and it has no predictions
+        null_alert = alerts_table[alerts_table['Metric'] == 'metric2'].iloc[0]
+        self.assertEqual(null_alert['Real'], 'No data')
+        self.assertTrue(pd.isna(null_alert['LimInf']))
+        self.assertNotIn('metric2', future_table['Metric'].values)
+
+if __name__ == '__main__':
+    unittest.main()
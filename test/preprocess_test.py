@@ -1,32 +1,111 @@
 from ..modules.preprocess import Preprocess
+import os
+import time
 import unittest
 import pandas as pd
 import numpy as np
+import numpy.testing as npt
+
+# Dates of the small sample data. They are the same for the input and the expected output
+_DATES = pd.date_range('2022-01-01', periods = 10, freq = 'D')
+
+def random_data(n_rows):
+    """
+    Function to create data with four metrics and a random mask of missing values.
+
+    :param n_rows: Number of rows of the data.
+    :type n_rows: int
+    """
+    rng = np.random.default_rng(0)
+    values = rng.standard_normal((n_rows, 4))
+    values[rng.random(values.shape) < 0.1] = np.nan
+    data = pd.DataFrame(values, columns = [f'metric{i}' for i in range(4)])
+    data.insert(0, 'date', pd.date_range('2000-01-01', periods = n_rows, freq = 'min'))
+
+    return data
 
 class TestPreprocess(unittest.TestCase):
 
-    def test_fill_moving_avg(self):
-        # Create sample data with missing values
-        data = pd.DataFrame({
-            'date': pd.date_range('2022-01-01', '2022-01-10'),
-            'metric1': [1, 2, np.nan, 4, 5, np.nan, np.nan, 8, 9, 10],
-            'metric2': [11, 12, 13, np.nan, 15, np.nan, np.nan, np.nan, 19, 20]
+    @classmethod
+    def setUpClass(cls):
+        # Create sample data with missing values. The metrics use the nullable float type, so the gaps are masked values
+        cls.data = pd.DataFrame({
+            'date': _DATES,
+            'metric1': pd.array([1, 2, pd.NA, 4, 5, pd.NA, pd.NA, 8, 9, 10], dtype = 'Float64'),
+            'metric2': pd.array([11, 12, 13, pd.NA, 15, pd.NA, pd.NA, pd.NA, 19, 20], dtype = 'Float64')
         })
         
-        # Create expected output
-        expected_output = pd.DataFrame({
-            'date': pd.date_range('2022-01-01', '2022-01-10'),
-            'metric1': [1, 2, 2, 4, 5, 4, 4, 8, 9, 10],
-            'metric2': [11, 12, 13, 13, 15, 15, 15, 15, 19, 20]
+        # Create expected output. Every gap is filled with the mean of the known values of the last 7 days
+        cls.expected_output = pd.DataFrame({
+            'date': _DATES,
+            'metric1': pd.array([1, 2, 1.5, 4, 5, 3, 3, 8, 9, 10], dtype = 'Float64'),
+            'metric2': pd.array([11, 12, 13, 12, 15, 12.75, 12.75, 40/3, 19, 20], dtype = 'Float64')
         })
         
-        # Create Preprocess object and fill missing values using moving average
-        preprocess = Preprocess()
-        output = preprocess.fill_moving_avg(data)
+        # Create Preprocess object. It is shared by all the tests
+        cls.preprocess = Preprocess()
+
+    def test_fill_moving_avg(self):
+        # Fill missing values using moving average. The data is copied because fill_moving_avg modifies it
+        output = self.preprocess.fill_moving_avg(self.data.copy())
         
-        # Check that output matches expected output
-        self.assertTrue(expected_output.equals(output))
+        # Check that the nullable float type of the metrics is kept
+        for c in ['metric1', 'metric2']:
+            with self.subTest(metric = c):
+                self.assertEqual(output[c].dtype, 'Float64')
+
+        # Check that output matches expected output. The values are compared whatever their dtype
+        pd.testing.assert_frame_equal(output.reset_index(drop = True), self.expected_output.reset_index(drop = True),
+                                      check_dtype = False, check_exact = False, rtol = 0, atol = 0)
+
+
+    def test_fill_moving_avg_null(self):
+        # Create sample data with a metric that has all values as null
+        data = self.data.copy()
+        data['metric3'] = np.nan
+
+        # Fill missing values using moving average
+        output = self.preprocess.fill_moving_avg(data)
+
+        # Check that the null metric is not filled and the others are
+        self.assertTrue(output['metric3'].isna().all())
+        self.assertFalse(output[['metric1', 'metric2']].isna().any().any())
+
+    def test_fill_moving_avg_large(self):
+        # Create a long sample data with a random mask of missing values
+        data = random_data(100000)
+        values = data.drop('date', axis = 1).to_numpy()
+
+        # Create expected output. The moving average of the last 7 days is calculated with cumulative sums
+        # Windows without data are filled with zero
+        window = 7
+        sums = np.cumsum(np.nan_to_num(values), axis = 0)
+        counts = np.cumsum(~np.isnan(values), axis = 0)
+        sums[window:] = sums[window:] - sums[:-window]
+        counts[window:] = counts[window:] - counts[:-window]
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            moving_avg = np.where(counts > 0, sums/counts, 0)
+        expected_values = np.where(np.isnan(values), moving_avg, values)
+
+        # Fill missing values using moving average
+        output = self.preprocess.fill_moving_avg(data)
+
+        # Check that there are no missing values left and that the gaps are filled with the moving average
+        output_values = output.drop('date', axis = 1).to_numpy(dtype = float)
+        self.assertFalse(np.isnan(output_values).any())
+        npt.assert_allclose(output_values, expected_values)
+
+    @unittest.skipUnless(os.environ.get('RUN_PERF'), 'Set RUN_PERF to run the performance tests')
+    def test_fill_moving_avg_perf(self):
+        # Create a sample data of one million rows. The time limit can be changed with PERF_CEIL (seconds)
+        data = random_data(1000000)
+        time_limit = float(os.environ.get('PERF_CEIL', '2.0'))
 
+        # Fill missing values using moving average and check that it takes less than the limit
+        start = time.perf_counter()
+        self.preprocess.fill_moving_avg(data)
+        elapsed = time.perf_counter() - start
+        self.assertLess(elapsed, time_limit)
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file